@@ -0,0 +1,23 @@
+{% macro size_aware_config(partition_field, cluster_by) %}
+    {#-
+        Materialize small clients as views and large ones as partitioned, clustered tables.
+        The client's source row count is passed in as the `client_source_rows` var by the
+        Prefect flow; without it every client stays on views.
+    -#}
+    {% set source_rows = var('client_source_rows', 0) | int %}
+    {% set threshold = var('large_client_row_threshold') | int %}
+
+    {% if source_rows >= threshold %}
+        {% do return({
+            'materialized': 'table',
+            'partition_by': {
+                'field': partition_field,
+                'data_type': 'date',
+                'granularity': 'month'
+            },
+            'cluster_by': cluster_by
+        }) %}
+    {% else %}
+        {% do return({'materialized': 'view'}) %}
+    {% endif %}
+{% endmacro %}
@@ -1,6 +1,9 @@
 {{
     config(
-        materialized='view'
+        **size_aware_config(
+            partition_field='budget_date',
+            cluster_by=['parent_account', 'sub_account', 'classification']
+        )
     )
 }}
 
@@ -1,6 +1,9 @@
 {{
     config(
-        materialized='view'
+        **size_aware_config(
+            partition_field='txnDate',
+            cluster_by=['parent_account', 'sub_account', 'classification']
+        )
     )
 }}
 
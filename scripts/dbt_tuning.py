@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""Per-client tuning of dbt threads, timeout and bytes-billed cap.
+
+Settings are derived from the width of the model DAG (from target/manifest.json)
+and from the client's recent runs, which are kept as JSON lines at
+`<tuning_uri>/<client>.jsonl` (a local path or gs:// URI). Each record holds the
+settings a run used together with its outcome, so the next choice builds on it.
+
+Show the settings the next run would use with:
+
+    python dbt_tuning.py --client golden_hour --tuning-uri gs://bucket/tuning
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import statistics
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Settings used when there is nothing to go on, matching the previous hard-coded profile
+DEFAULT_SETTINGS = {"threads": 4, "timeout_seconds": 300, "maximum_bytes_billed": None}
+
+MAX_THREADS = 8
+SMALL_CLIENT_SECONDS = 60       # total model time below which extra threads don't pay off
+SMALL_CLIENT_THREADS = 2
+MIN_TIMEOUT_SECONDS = 120
+MAX_TIMEOUT_SECONDS = 3600
+TIMEOUT_HEADROOM = 3            # multiple of the slowest recent model
+MIN_BYTES_BILLED = 1024 ** 3    # never cap below 1 GiB
+BYTES_HEADROOM = 4              # multiple of the largest recent model
+HISTORY_RUNS = 10               # recent runs considered when choosing
+HISTORY_KEEP = 50               # runs kept in the history file
+RATE_LIMIT_RELEASE_RUNS = 3     # clean runs needed to raise a rate-limit thread ceiling by one
+
+RATE_LIMIT_MARKERS = ("rateLimitExceeded", "quotaExceeded", "Exceeded rate limits")
+TIMEOUT_MARKERS = ("designated timeout", "timed out", "Deadline Exceeded")
+BYTES_LIMIT_MARKERS = ("bytesBilledLimitExceeded", "exceeded limit for bytes billed")
+
+
+def dag_width(manifest_path: str) -> Optional[int]:
+    """Return the largest number of models at the same depth of the DAG, or None without a manifest."""
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    models = {
+        unique_id: node.get("depends_on", {}).get("nodes", [])
+        for unique_id, node in manifest.get("nodes", {}).items()
+        if node.get("resource_type") == "model"
+    }
+    depths: Dict[str, int] = {}
+
+    def depth(unique_id: str) -> int:
+        if unique_id not in depths:
+            depths[unique_id] = 0  # guards against cycles
+            parents = [p for p in models[unique_id] if p in models]
+            depths[unique_id] = 1 + max((depth(p) for p in parents), default=-1)
+        return depths[unique_id]
+
+    per_level = defaultdict(int)
+    for unique_id in models:
+        per_level[depth(unique_id)] += 1
+    return max(per_level.values(), default=None)
+
+
+def _remote_history_path(tuning_uri: str, client: str):
+    # pyarrow is only needed for remote (gs://) history, so plain dbt setups work without it
+    from pyarrow import fs as pafs
+
+    filesystem, root = pafs.FileSystem.from_uri(tuning_uri)
+    return pafs, filesystem, f"{root.rstrip('/')}/{client}.jsonl"
+
+
+def _local_history_path(tuning_uri: str, client: str) -> str:
+    return os.path.join(os.path.abspath(os.path.expanduser(tuning_uri)), f"{client}.jsonl")
+
+
+def _read_history(tuning_uri: str, client: str) -> str:
+    if "://" not in tuning_uri:
+        path = _local_history_path(tuning_uri, client)
+        if not os.path.exists(path):
+            return ""
+        with open(path) as f:
+            return f.read()
+
+    pafs, filesystem, path = _remote_history_path(tuning_uri, client)
+    if filesystem.get_file_info(path).type == pafs.FileType.NotFound:
+        return ""
+    with filesystem.open_input_stream(path) as f:
+        return f.read().decode("utf-8")
+
+
+def _write_history(tuning_uri: str, client: str, content: str) -> None:
+    if "://" not in tuning_uri:
+        path = _local_history_path(tuning_uri, client)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+        return
+
+    _, filesystem, path = _remote_history_path(tuning_uri, client)
+    filesystem.create_dir(path.rsplit("/", 1)[0], recursive=True)
+    with filesystem.open_output_stream(path) as f:
+        f.write(content.encode("utf-8"))
+
+
+def load_history(tuning_uri: str, client: str) -> List[Dict]:
+    """Return the client's recorded runs, oldest first."""
+    return [json.loads(line) for line in _read_history(tuning_uri, client).splitlines() if line.strip()]
+
+
+def _matches(error: Optional[str], markers) -> bool:
+    return bool(error) and any(marker in error for marker in markers)
+
+
+def rate_limit_ceiling(history: List[Dict]) -> Optional[int]:
+    """Return the thread ceiling left by rate-limited runs, or None if there were none.
+
+    The ceiling is one below the fewest threads that were rate limited, and is
+    raised by one for every RATE_LIMIT_RELEASE_RUNS clean runs (per rate-limited
+    run) since the last rate-limited one. Threads climb back
+    gradually instead of jumping straight to the DAG width, and repeated limits
+    at the same level make further probing rarer.
+    """
+    limited = [
+        i for i, run in enumerate(history)
+        if _matches(run["outcome"].get("error"), RATE_LIMIT_MARKERS)
+    ]
+    if not limited:
+        return None
+    lowest = min(history[i]["settings"]["threads"] for i in limited)
+    clean_since = sum(
+        1 for run in history[limited[-1] + 1:]
+        if not _matches(run["outcome"].get("error"), RATE_LIMIT_MARKERS)
+    )
+    return max(1, lowest - 1 + clean_since // (RATE_LIMIT_RELEASE_RUNS * len(limited)))
+
+
+def choose_settings(history: List[Dict], width: Optional[int]) -> Dict:
+    """Choose threads, timeout_seconds and maximum_bytes_billed for the next run.
+
+    Returns the settings plus a `reasons` list explaining each choice.
+    """
+    settings = dict(DEFAULT_SETTINGS)
+    reasons = []
+    recent = history[-HISTORY_RUNS:]
+    successful = [run for run in recent if run["outcome"]["status"] == "success"]
+    last = recent[-1] if recent else None
+
+    # Threads: no more than the DAG can use, fewer for clients whose models are quick anyway
+    if width:
+        settings["threads"] = max(1, min(width, MAX_THREADS))
+        reasons.append(f"threads={settings['threads']} from DAG width {width}")
+    if successful:
+        total_model_seconds = statistics.median(
+            sum(run["outcome"]["model_seconds"].values()) for run in successful
+        )
+        if total_model_seconds < SMALL_CLIENT_SECONDS and settings["threads"] > SMALL_CLIENT_THREADS:
+            settings["threads"] = SMALL_CLIENT_THREADS
+            reasons.append(f"threads={SMALL_CLIENT_THREADS} as models take {total_model_seconds:.0f}s in total")
+    # Looks at the whole kept history so the ceiling doesn't vanish when limited runs leave the window
+    ceiling = rate_limit_ceiling(history)
+    if ceiling is not None and settings["threads"] > ceiling:
+        settings["threads"] = ceiling
+        reasons.append(f"threads={ceiling} capped by recent rate-limited runs")
+
+    # Timeout: headroom over the slowest model seen recently
+    slowest = max(
+        (seconds for run in successful for seconds in run["outcome"]["model_seconds"].values()),
+        default=None,
+    )
+    if slowest is not None:
+        settings["timeout_seconds"] = int(min(
+            MAX_TIMEOUT_SECONDS, max(MIN_TIMEOUT_SECONDS, math.ceil(slowest * TIMEOUT_HEADROOM))
+        ))
+        reasons.append(f"timeout_seconds={settings['timeout_seconds']} from slowest model {slowest:.0f}s")
+    if last and _matches(last["outcome"].get("error"), TIMEOUT_MARKERS):
+        settings["timeout_seconds"] = min(MAX_TIMEOUT_SECONDS, last["settings"]["timeout_seconds"] * 2)
+        reasons.append(f"timeout_seconds={settings['timeout_seconds']} after a timed out run")
+
+    # Bytes billed: headroom over the largest model seen recently, so a runaway query fails fast
+    largest = max(
+        (billed for run in successful for billed in run["outcome"]["model_bytes_billed"].values()),
+        default=None,
+    )
+    if largest:
+        settings["maximum_bytes_billed"] = max(MIN_BYTES_BILLED, largest * BYTES_HEADROOM)
+        reasons.append(f"maximum_bytes_billed={settings['maximum_bytes_billed']} from largest model {largest} bytes")
+    if last and _matches(last["outcome"].get("error"), BYTES_LIMIT_MARKERS) and last["settings"].get("maximum_bytes_billed"):
+        settings["maximum_bytes_billed"] = last["settings"]["maximum_bytes_billed"] * 2
+        reasons.append(f"maximum_bytes_billed={settings['maximum_bytes_billed']} after hitting the limit")
+
+    if not reasons:
+        reasons.append("defaults, no manifest or run history yet")
+    settings["reasons"] = reasons
+    return settings
+
+
+def run_outcome(run_results_path: str, status: str, error: Optional[str] = None,
+                started_at: Optional[float] = None) -> Dict:
+    """Summarise a dbt run from run_results.json: per-model seconds and bytes billed.
+
+    `error` is the message the run failed with, if any. The first failing model's
+    adapter message takes its place in `outcome["error"]`, as the caller only sees
+    the shell's exit status; the caller's message is kept in `run_error`.
+    """
+    outcome = {"status": status, "error": error, "run_error": error, "elapsed_seconds": None,
+               "model_seconds": {}, "model_bytes_billed": {}}
+    fresh = os.path.exists(run_results_path) and (
+        started_at is None or os.path.getmtime(run_results_path) >= started_at
+    )
+    if not fresh:
+        return outcome
+
+    with open(run_results_path) as f:
+        run_results = json.load(f)
+    outcome["elapsed_seconds"] = run_results.get("elapsed_time")
+    for result in run_results.get("results", []):
+        unique_id = result.get("unique_id")
+        outcome["model_seconds"][unique_id] = result.get("execution_time") or 0
+        billed = (result.get("adapter_response") or {}).get("bytes_billed")
+        if billed is not None:
+            outcome["model_bytes_billed"][unique_id] = billed
+        # Surface adapter errors such as timeouts or the bytes cap for the next choice
+        if result.get("status") == "error" and result.get("message") and outcome["error"] == error:
+            outcome["error"] = result["message"]
+    return outcome
+
+
+def record_run(tuning_uri: str, client: str, settings: Dict, outcome: Dict) -> None:
+    """Append a run's settings and outcome to the client's history, keeping the latest runs."""
+    history = load_history(tuning_uri, client)
+    history.append({
+        "client": client,
+        "recorded_at": datetime.now(timezone.utc).isoformat(),
+        "settings": {key: settings.get(key) for key in DEFAULT_SETTINGS},
+        "reasons": settings.get("reasons", []),
+        "outcome": outcome,
+    })
+    _write_history(tuning_uri, client, "".join(json.dumps(record) + "\n" for record in history[-HISTORY_KEEP:]))
+
+
+def settings_for_client(client: Optional[str], tuning_uri: Optional[str], dbt_project_dir: str) -> Dict:
+    """Choose settings for a client from the project's manifest and the client's history.
+
+    Without a tuning_uri, tuning is off and DEFAULT_SETTINGS are used. Without a
+    client or history, only the DAG width is taken into account.
+    """
+    if not tuning_uri:
+        return dict(DEFAULT_SETTINGS, reasons=["tuning disabled, no tuning_uri set"])
+    history = []
+    if client:
+        try:
+            history = load_history(tuning_uri, client)
+        except Exception as e:
+            logging.warning(f"Could not load run history for {client} from {tuning_uri}: {e}")
+    width = dag_width(os.path.join(dbt_project_dir, "target", "manifest.json"))
+    return choose_settings(history, width)
+
+
+def profile_settings(settings: Dict) -> Dict:
+    """Return the subset of settings that belongs in a profiles.yml output."""
+    return {key: settings[key] for key in DEFAULT_SETTINGS if settings.get(key) is not None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show the dbt settings chosen for a client')
+    parser.add_argument('--client', required=True, help='Client name (dataset in BigQuery)')
+    parser.add_argument('--tuning-uri', required=True, help='Local path or gs:// URI of the run history')
+    parser.add_argument('--project-dir', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        help='dbt project directory')
+    args = parser.parse_args()
+
+    settings = settings_for_client(args.client, args.tuning_uri, args.project_dir)
+    print(json.dumps(settings, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""Tests for the per-client dbt settings heuristics."""
+import json
+
+import pytest
+
+from dbt_tuning import (
+    DEFAULT_SETTINGS, RATE_LIMIT_RELEASE_RUNS, SMALL_CLIENT_THREADS,
+    choose_settings, rate_limit_ceiling, run_outcome, settings_for_client,
+)
+
+SHELL_ERROR = "Command failed with exit code 1 (PID 4242)"
+MODEL = "model.holistic_money_dw.p_l_view"
+
+
+def make_run(threads=8, timeout_seconds=300, maximum_bytes_billed=None, error=None, model_seconds=120,
+             bytes_billed=10 * 1024 ** 3):
+    return {
+        "settings": {"threads": threads, "timeout_seconds": timeout_seconds,
+                     "maximum_bytes_billed": maximum_bytes_billed},
+        "outcome": {
+            "status": "error" if error else "success",
+            "error": error,
+            "model_seconds": {MODEL: model_seconds},
+            "model_bytes_billed": {MODEL: bytes_billed},
+        },
+    }
+
+
+def write_run_results(tmp_path, message):
+    path = tmp_path / "run_results.json"
+    path.write_text(json.dumps({
+        "elapsed_time": 312.5,
+        "results": [
+            {"unique_id": "model.holistic_money_dw.stg_budget_template", "status": "success",
+             "execution_time": 4.2, "message": "CREATE VIEW (0 processed)",
+             "adapter_response": {"bytes_billed": 0}},
+            {"unique_id": MODEL, "status": "error", "execution_time": 300.1, "message": message,
+             "adapter_response": {}},
+        ],
+    }))
+    return str(path)
+
+
+def test_timeout_doubles_after_a_failed_shell_run(tmp_path):
+    path = write_run_results(
+        tmp_path, "Operation did not complete within the designated timeout of 300 seconds."
+    )
+
+    outcome = run_outcome(path, "error", SHELL_ERROR)
+    assert outcome["error"].startswith("Operation did not complete within the designated timeout")
+    assert outcome["run_error"] == SHELL_ERROR
+
+    history = [make_run(), {"settings": make_run()["settings"], "outcome": outcome}]
+    assert choose_settings(history, width=4)["timeout_seconds"] == 600
+
+
+def test_bytes_cap_doubles_after_a_failed_shell_run(tmp_path):
+    path = write_run_results(
+        tmp_path, "Query exceeded limit for bytes billed: 1073741824. 2147483648 or higher required."
+    )
+    cap = 40 * 1024 ** 3
+
+    history = [make_run(), {"settings": make_run(maximum_bytes_billed=cap)["settings"],
+                            "outcome": run_outcome(path, "error", SHELL_ERROR)}]
+    assert choose_settings(history, width=4)["maximum_bytes_billed"] == cap * 2
+
+
+def test_stale_run_results_are_ignored(tmp_path):
+    path = write_run_results(tmp_path, "designated timeout")
+
+    outcome = run_outcome(path, "error", SHELL_ERROR, started_at=float("inf"))
+    assert outcome["error"] == SHELL_ERROR
+    assert outcome["model_seconds"] == {}
+
+
+def test_rate_limit_ceiling_is_released_gradually():
+    limited = make_run(threads=6, error="Exceeded rate limits: too many table update operations")
+    assert rate_limit_ceiling([make_run()]) is None
+    assert rate_limit_ceiling([limited]) == 5
+
+    history = [limited] + [make_run(threads=5)] * RATE_LIMIT_RELEASE_RUNS
+    assert rate_limit_ceiling(history) == 6
+    assert choose_settings(history, width=8)["threads"] == 6
+
+    # A second limit at the same level halves the release rate
+    history = [limited, make_run(threads=5), limited] + [make_run(threads=5)] * RATE_LIMIT_RELEASE_RUNS
+    assert rate_limit_ceiling(history) == 5
+    history += [make_run(threads=5)] * RATE_LIMIT_RELEASE_RUNS
+    assert rate_limit_ceiling(history) == 6
+
+
+def test_small_client_drops_threads():
+    history = [make_run(model_seconds=10)] * 3
+    settings = choose_settings(history, width=6)
+    assert settings["threads"] == SMALL_CLIENT_THREADS
+
+    assert choose_settings([make_run(model_seconds=120)] * 3, width=6)["threads"] == 6
+
+
+def test_defaults_without_tuning_uri(tmp_path):
+    settings = settings_for_client("golden_hour", None, str(tmp_path))
+    assert {key: settings[key] for key in DEFAULT_SETTINGS} == DEFAULT_SETTINGS
+    assert settings["reasons"] == ["tuning disabled, no tuning_uri set"]
+
+
+@pytest.mark.parametrize("history", [[], [make_run(error=SHELL_ERROR)]])
+def test_defaults_without_manifest_or_useful_history(history):
+    settings = choose_settings(history, width=None)
+    assert settings["timeout_seconds"] == DEFAULT_SETTINGS["timeout_seconds"]
+    assert settings["threads"] == DEFAULT_SETTINGS["threads"]
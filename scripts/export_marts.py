@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""Export per-client marts to partitioned Parquet snapshots.
+
+Streams `materialized_pl_budget_blend` and `profit_by_month` out of BigQuery page by
+page and writes one zstd-compressed Parquet file per client and month:
+
+    <export_uri>/<model>/client=<client>/month=<YYYY-MM>/part-0.parquet
+
+A manifest per client records what each month looked like when it was last
+exported, so later runs only rewrite months whose data actually changed.
+"""
+import argparse
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import fs as pafs
+from google.cloud import bigquery
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+PAGE_SIZE = 10000
+
+BLEND_SCHEMA = pa.schema([
+    ("entry_id", pa.string()),
+    ("txnDate", pa.date32()),
+    ("parent_account", pa.string()),
+    ("sub_account", pa.string()),
+    ("child_account", pa.string()),
+    ("classification", pa.string()),
+    ("account_type", pa.string()),
+    ("actual", pa.float64()),
+    ("budget_amount", pa.float64()),
+    ("last_refreshed", pa.timestamp("us", tz="UTC")),
+])
+
+PROFIT_SCHEMA = pa.schema([
+    ("txnDate", pa.date32()),
+    ("gross_profit_actual", pa.float64()),
+    ("gross_profit_budget", pa.float64()),
+    ("net_profit_actual", pa.float64()),
+    ("net_profit_budget", pa.float64()),
+    ("net_cash_actual", pa.float64()),
+    ("net_cash_budget", pa.float64()),
+])
+
+EXPORTED_MODELS = {
+    "materialized_pl_budget_blend": BLEND_SCHEMA,
+    "profit_by_month": PROFIT_SCHEMA,
+}
+
+# The blend re-stamps last_refreshed on most rows each run but keeps the old one on
+# historical rows it zeroes out, so it says nothing about whether a month changed.
+# The fingerprint and row count decide; last_refreshed is only kept for reference.
+# Rows without a txnDate have no month partition and are not exported.
+MONTH_STATE_QUERY = """
+    SELECT
+        FORMAT_DATE('%Y-%m', txnDate) AS month,
+        MAX(last_refreshed) AS last_refreshed,
+        COUNT(*) AS row_count,
+        BIT_XOR(FARM_FINGERPRINT(TO_JSON_STRING(STRUCT(
+            entry_id, parent_account, sub_account, child_account,
+            classification, account_type, actual, budget_amount
+        )))) AS fingerprint
+    FROM `{dataset}.materialized_pl_budget_blend`
+    WHERE txnDate IS NOT NULL
+    GROUP BY month
+"""
+
+EXPORT_QUERY = """
+    SELECT {columns}
+    FROM `{dataset}.{model}`
+    WHERE txnDate IS NOT NULL
+      AND FORMAT_DATE('%Y-%m', txnDate) IN UNNEST(@months)
+    ORDER BY txnDate
+"""
+
+
+def marts_dataset(gcp_project: str, client: str) -> str:
+    """Return the dataset dbt builds the client's marts in (`+schema: marts`)."""
+    return f"{gcp_project}.{client}_marts"
+
+
+def _manifest_path(root: str, client: str) -> str:
+    return f"{root}/_manifest/{client}.json"
+
+
+def load_manifest(filesystem: pafs.FileSystem, root: str, client: str) -> Dict:
+    path = _manifest_path(root, client)
+    if filesystem.get_file_info(path).type == pafs.FileType.NotFound:
+        return {}
+    with filesystem.open_input_stream(path) as f:
+        return json.loads(f.read().decode("utf-8"))
+
+
+def save_manifest(filesystem: pafs.FileSystem, root: str, client: str, manifest: Dict) -> None:
+    path = _manifest_path(root, client)
+    filesystem.create_dir(path.rsplit("/", 1)[0], recursive=True)
+    with filesystem.open_output_stream(path) as f:
+        f.write(json.dumps(manifest, indent=2, sort_keys=True).encode("utf-8"))
+
+
+def month_states(bq_client: bigquery.Client, dataset: str) -> Dict[str, Dict]:
+    """Return the current last_refreshed, row count and fingerprint of each month in the blend."""
+    rows = bq_client.query(MONTH_STATE_QUERY.format(dataset=dataset)).result()
+    return {
+        row["month"]: {
+            "last_refreshed": row["last_refreshed"].isoformat() if row["last_refreshed"] else None,
+            "row_count": row["row_count"],
+            "fingerprint": row["fingerprint"],
+        }
+        for row in rows
+    }
+
+
+def changed_months(current: Dict[str, Dict], exported: Dict[str, Dict]) -> List[str]:
+    """Return months that are new, or whose content changed since the last export."""
+    changed = []
+    for month, state in current.items():
+        previous = exported.get(month)
+        if (
+            previous is None
+            or state["fingerprint"] != previous["fingerprint"]
+            or state["row_count"] != previous["row_count"]
+        ):
+            changed.append(month)
+    return sorted(changed)
+
+
+def _partition_path(root: str, model: str, client: str, month: str) -> str:
+    return f"{root}/{model}/client={client}/month={month}"
+
+
+def _month_runs(batch: pa.RecordBatch) -> Iterable:
+    """Yield (month, slice) for each contiguous run of one month in a txnDate-ordered batch."""
+    months = [d.strftime("%Y-%m") for d in batch.column("txnDate").to_pylist()]
+    start = 0
+    for i in range(1, len(months) + 1):
+        if i == len(months) or months[i] != months[start]:
+            yield months[start], batch.slice(start, i - start)
+            start = i
+
+
+def export_model(
+    bq_client: bigquery.Client,
+    filesystem: pafs.FileSystem,
+    root: str,
+    dataset: str,
+    client: str,
+    model: str,
+    months: List[str],
+    page_size: int = PAGE_SIZE,
+) -> int:
+    """Stream the given months of a model into one Parquet file per month. Returns rows written."""
+    schema = EXPORTED_MODELS[model]
+    sql = EXPORT_QUERY.format(
+        columns=", ".join(f"`{name}`" for name in schema.names),
+        dataset=dataset,
+        model=model,
+    )
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("months", "STRING", months)]
+    )
+    rows = bq_client.query(sql, job_config=job_config).result(page_size=page_size)
+
+    writer = None
+    current_month = None
+    written = 0
+    try:
+        for batch in rows.to_arrow_iterable():
+            for month, part in _month_runs(batch):
+                if month != current_month:
+                    if writer:
+                        writer.close()
+                    partition = _partition_path(root, model, client, month)
+                    filesystem.create_dir(partition, recursive=True)
+                    writer = pq.ParquetWriter(
+                        f"{partition}/part-0.parquet",
+                        schema,
+                        filesystem=filesystem,
+                        compression="zstd",
+                    )
+                    current_month = month
+                writer.write_table(pa.Table.from_batches([part]).select(schema.names).cast(schema))
+                written += part.num_rows
+    finally:
+        if writer:
+            writer.close()
+    return written
+
+
+def remove_partitions(filesystem: pafs.FileSystem, root: str, client: str, months: List[str]) -> None:
+    """Delete exported partitions for months that no longer exist in the blend."""
+    for model in EXPORTED_MODELS:
+        for month in months:
+            partition = _partition_path(root, model, client, month)
+            if filesystem.get_file_info(partition).type != pafs.FileType.NotFound:
+                filesystem.delete_dir(partition)
+
+
+def export_client(
+    bq_client: bigquery.Client,
+    gcp_project: str,
+    client: str,
+    export_uri: str,
+    page_size: int = PAGE_SIZE,
+    force: bool = False,
+) -> Dict:
+    """Export the months of a client's marts that changed since the last export."""
+    if "://" not in export_uri:
+        export_uri = os.path.abspath(export_uri)
+    filesystem, root = pafs.FileSystem.from_uri(export_uri)
+    root = root.rstrip("/")
+    dataset = marts_dataset(gcp_project, client)
+
+    manifest = load_manifest(filesystem, root, client)
+    current = month_states(bq_client, dataset)
+    months = sorted(current) if force else changed_months(current, manifest.get("months", {}))
+    removed = sorted(set(manifest.get("months", {})) - set(current))
+
+    summary = {"client": client, "months": months, "removed": removed, "rows": {}}
+    if not months and not removed:
+        logging.info(f"No changed months to export for {client}")
+        return summary
+
+    if months:
+        logging.info(f"Exporting {len(months)} changed month(s) for {client}: {', '.join(months)}")
+        for model in EXPORTED_MODELS:
+            summary["rows"][model] = export_model(
+                bq_client, filesystem, root, dataset, client, model, months, page_size
+            )
+    if removed:
+        logging.info(f"Removing {len(removed)} stale month(s) for {client}: {', '.join(removed)}")
+        remove_partitions(filesystem, root, client, removed)
+
+    save_manifest(filesystem, root, client, {
+        "client": client,
+        "exported_at": datetime.now(timezone.utc).isoformat(),
+        "months": current,
+    })
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export client marts to partitioned Parquet files')
+    parser.add_argument('--client', required=True, action='append', help='Client name (repeatable)')
+    parser.add_argument('--project', default='holistic-money', help='GCP project ID')
+    parser.add_argument('--export-uri', required=True, help='Local path or gs:// URI to export to')
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help='Rows fetched per page')
+    parser.add_argument('--force', action='store_true', help='Re-export every month, even unchanged ones')
+    args = parser.parse_args()
+
+    bq_client = bigquery.Client(project=args.project)
+    for client in args.client:
+        summary = export_client(bq_client, args.project, client, args.export_uri, args.page_size, args.force)
+        logging.info(f"Export summary: {summary}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Tests for the incremental Parquet export, against a fake BigQuery client and the local filesystem."""
+from datetime import date, datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from pyarrow import fs as pafs
+
+from export_marts import EXPORTED_MODELS, export_client, export_model
+
+PROJECT = "holistic-money"
+CLIENT = "golden_hour"
+DATASET = f"{PROJECT}.{CLIENT}_marts"
+REFRESHED = datetime(2025, 2, 1, tzinfo=timezone.utc)
+
+
+def blend_row(entry_id, txn_date, actual, last_refreshed=REFRESHED):
+    return {
+        "entry_id": entry_id, "txnDate": txn_date, "parent_account": "Income", "sub_account": "Sales",
+        "child_account": None, "classification": "Revenue", "account_type": "Income",
+        "actual": actual, "budget_amount": 80.0, "last_refreshed": last_refreshed,
+    }
+
+
+def profit_row(txn_date, net_profit_actual):
+    return {
+        "txnDate": txn_date, "gross_profit_actual": net_profit_actual, "gross_profit_budget": 80.0,
+        "net_profit_actual": net_profit_actual, "net_profit_budget": 80.0,
+        "net_cash_actual": net_profit_actual, "net_cash_budget": 80.0,
+    }
+
+
+class FakeRowIterator:
+    def __init__(self, rows, schema=None, page_size=None):
+        self.rows = rows
+        self.schema = schema
+        self.page_size = page_size or len(rows) or 1
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def to_arrow_iterable(self):
+        for start in range(0, len(self.rows), self.page_size):
+            yield pa.RecordBatch.from_pylist(self.rows[start:start + self.page_size], schema=self.schema)
+
+
+class FakeQueryJob:
+    def __init__(self, rows, schema=None):
+        self.rows = rows
+        self.schema = schema
+
+    def result(self, page_size=None):
+        return FakeRowIterator(self.rows, self.schema, page_size)
+
+
+class FakeBigQuery:
+    """Serves the month state and export queries from in-memory rows per model."""
+
+    def __init__(self, blend, profit):
+        self.tables = {"materialized_pl_budget_blend": blend, "profit_by_month": profit}
+
+    def query(self, sql, job_config=None):
+        if "GROUP BY month" in sql:
+            return FakeQueryJob(self._month_states())
+        model = next(m for m in EXPORTED_MODELS if f"{DATASET}.{m}`" in sql)
+        months = job_config.query_parameters[0].values
+        rows = sorted(
+            (row for row in self.tables[model] if row["txnDate"].strftime("%Y-%m") in months),
+            key=lambda row: row["txnDate"],
+        )
+        return FakeQueryJob(rows, EXPORTED_MODELS[model])
+
+    def _month_states(self):
+        months = {}
+        for row in self.tables["materialized_pl_budget_blend"]:
+            months.setdefault(row["txnDate"].strftime("%Y-%m"), []).append(row)
+        return [
+            {
+                "month": month,
+                "last_refreshed": max(row["last_refreshed"] for row in rows),
+                "row_count": len(rows),
+                "fingerprint": hash(frozenset(
+                    tuple(v for k, v in row.items() if k not in ("txnDate", "last_refreshed")) for row in rows
+                )),
+            }
+            for month, rows in months.items()
+        ]
+
+
+@pytest.fixture
+def bq_client():
+    return FakeBigQuery(
+        blend=[
+            blend_row("e1", date(2025, 1, 3), 100.0),
+            blend_row("e2", date(2025, 1, 15), 50.0),
+            blend_row("e3", date(2025, 1, 31), 25.0),
+            blend_row("e4", date(2025, 2, 10), 10.0),
+        ],
+        profit=[profit_row(date(2025, 1, 1), 175.0), profit_row(date(2025, 2, 1), 10.0)],
+    )
+
+
+def partition(tmp_path, model, month):
+    return tmp_path / model / f"client={CLIENT}" / f"month={month}"
+
+
+def test_month_split_across_pages_is_written_to_one_file(tmp_path, bq_client):
+    written = export_model(
+        bq_client, pafs.LocalFileSystem(), str(tmp_path), DATASET, CLIENT,
+        "materialized_pl_budget_blend", ["2025-01", "2025-02"], page_size=2,
+    )
+
+    assert written == 4
+    january = partition(tmp_path, "materialized_pl_budget_blend", "2025-01")
+    assert [p.name for p in january.iterdir()] == ["part-0.parquet"]
+    assert pq.read_table(january / "part-0.parquet").column("entry_id").to_pylist() == ["e1", "e2", "e3"]
+
+
+def test_unchanged_months_are_skipped(tmp_path, bq_client):
+    first = export_client(bq_client, PROJECT, CLIENT, str(tmp_path), page_size=2)
+    assert first["months"] == ["2025-01", "2025-02"]
+
+    assert export_client(bq_client, PROJECT, CLIENT, str(tmp_path))["months"] == []
+
+
+def test_zeroed_historical_rows_are_re_exported(tmp_path, bq_client):
+    export_client(bq_client, PROJECT, CLIENT, str(tmp_path))
+
+    # Historical rows keep their old last_refreshed while the amounts are zeroed
+    bq_client.tables["materialized_pl_budget_blend"][3] = blend_row("e4", date(2025, 2, 10), 0.0)
+    bq_client.tables["profit_by_month"][1] = profit_row(date(2025, 2, 1), 0.0)
+    summary = export_client(bq_client, PROJECT, CLIENT, str(tmp_path))
+
+    assert summary["months"] == ["2025-02"]
+    profit = pq.read_table(partition(tmp_path, "profit_by_month", "2025-02") / "part-0.parquet")
+    assert profit.column("net_profit_actual").to_pylist() == [0.0]
+
+
+@pytest.mark.parametrize("force", [False, True])
+def test_removed_months_are_deleted(tmp_path, bq_client, force):
+    export_client(bq_client, PROJECT, CLIENT, str(tmp_path))
+
+    for model, rows in bq_client.tables.items():
+        rows[:] = [row for row in rows if row["txnDate"].month != 2]
+    summary = export_client(bq_client, PROJECT, CLIENT, str(tmp_path), force=force)
+
+    assert summary["removed"] == ["2025-02"]
+    assert summary["months"] == (["2025-01"] if force else [])
+    for model in EXPORTED_MODELS:
+        assert not partition(tmp_path, model, "2025-02").exists()
+        assert partition(tmp_path, model, "2025-01").exists()
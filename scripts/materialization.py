@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Data-volume-aware materialization of the core models.
+
+Counts a client's QuickBooks source rows from BigQuery table metadata and decides
+whether `p_l_view` and `budget_transformed` should stay views or become
+partitioned, clustered tables (see macros/size_aware_config.sql). The flow passes
+the count to dbt as the `client_source_rows` var.
+
+Show which clients are switched and why with:
+
+    python materialization.py report --client golden_hour --client bb_design
+
+Print the --vars argument for a manual dbt run with:
+
+    python materialization.py vars --client golden_hour
+"""
+import argparse
+import json
+import logging
+import os
+from typing import Dict, List
+
+import yaml
+from google.cloud import bigquery
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# QuickBooks tables loaded by Airbyte that the core models read from
+SOURCE_TABLES = [
+    "accounts",
+    "bill_payments",
+    "bills",
+    "deposits",
+    "invoices",
+    "items",
+    "journal_entries",
+    "payments",
+    "purchases",
+    "sales_receipts",
+]
+
+SIZE_AWARE_MODELS = ["p_l_view", "budget_transformed"]
+
+SOURCE_ROWS_QUERY = """
+    SELECT table_id, row_count
+    FROM `{project}.{client}.__TABLES__`
+    WHERE table_id IN UNNEST(@tables)
+"""
+
+CURRENT_TYPES_QUERY = """
+    SELECT table_name, table_type
+    FROM `{project}.{client}_core.INFORMATION_SCHEMA.TABLES`
+    WHERE table_name IN UNNEST(@models)
+"""
+
+
+def row_threshold(dbt_project_dir: str) -> int:
+    """Read `large_client_row_threshold` from dbt_project.yml."""
+    with open(os.path.join(dbt_project_dir, "dbt_project.yml")) as f:
+        project = yaml.safe_load(f)
+    return int(project["vars"]["large_client_row_threshold"])
+
+
+def source_row_counts(bq_client: bigquery.Client, project: str, client: str) -> Dict[str, int]:
+    """Return the row count of each QuickBooks source table, from table metadata (no scan)."""
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("tables", "STRING", SOURCE_TABLES)]
+    )
+    rows = bq_client.query(SOURCE_ROWS_QUERY.format(project=project, client=client), job_config=job_config).result()
+    return {row["table_id"]: row["row_count"] for row in rows}
+
+
+def current_materializations(bq_client: bigquery.Client, project: str, client: str) -> Dict[str, str]:
+    """Return how each size-aware model currently exists in the client's core dataset."""
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[bigquery.ArrayQueryParameter("models", "STRING", SIZE_AWARE_MODELS)]
+    )
+    try:
+        rows = bq_client.query(
+            CURRENT_TYPES_QUERY.format(project=project, client=client), job_config=job_config
+        ).result()
+    except Exception as e:
+        logging.warning(f"Could not read current core relations for {client}: {e}")
+        return {}
+    return {row["table_name"]: "table" if row["table_type"] == "BASE TABLE" else "view" for row in rows}
+
+
+def decide(client: str, counts: Dict[str, int], threshold: int) -> Dict:
+    """Decide the core materialization for a client and explain why."""
+    total = sum(counts.values())
+    largest = max(counts, key=counts.get) if counts else None
+    if total >= threshold:
+        materialized = "table"
+        reason = f"{total:,} source rows >= threshold {threshold:,}"
+    else:
+        materialized = "view"
+        reason = f"{total:,} source rows < threshold {threshold:,}"
+    if largest:
+        reason += f" (largest: {largest} with {counts[largest]:,})"
+    return {
+        "client": client,
+        "source_rows": total,
+        "threshold": threshold,
+        "materialized": materialized,
+        "reason": reason,
+    }
+
+
+def dbt_vars(decision: Dict) -> str:
+    """Return the --vars argument that makes dbt apply the decision."""
+    return json.dumps({"client_source_rows": decision["source_rows"]})
+
+
+def report(bq_client: bigquery.Client, project: str, clients: List[str], dbt_project_dir: str) -> str:
+    """Render which clients' core models will be switched between views and tables, and why."""
+    threshold = row_threshold(dbt_project_dir)
+    lines = [f"{'client':<28} {'source rows':>12}  {'current':<8} {'planned':<8} {'switch':<6} reason"]
+    for client in clients:
+        try:
+            decision = decide(client, source_row_counts(bq_client, project, client), threshold)
+        except Exception as e:
+            logging.warning(f"Could not count source rows for {client}: {e}")
+            lines.append(f"{client:<28} {'-':>12}  {'-':<8} {'-':<8} {'-':<6} could not count source rows: {e}")
+            continue
+        current = current_materializations(bq_client, project, client)
+        current_types = sorted(set(current.values())) or ["-"]
+        # A model that isn't built yet is created fresh, not switched
+        switched = any(current[m] != decision["materialized"] for m in SIZE_AWARE_MODELS if m in current)
+        lines.append(
+            f"{client:<28} {decision['source_rows']:>12,}  {'/'.join(current_types):<8} "
+            f"{decision['materialized']:<8} {'yes' if switched else 'no':<6} {decision['reason']}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Choose core materializations from client data volume')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    report_parser = subparsers.add_parser('report', help='Show which clients are switched to tables and why')
+    report_parser.add_argument('--client', required=True, action='append', help='Client name (repeatable)')
+    vars_parser = subparsers.add_parser('vars', help='Print the dbt --vars argument for a client')
+    vars_parser.add_argument('--client', required=True, help='Client name')
+    for subparser in (report_parser, vars_parser):
+        subparser.add_argument('--project', default='holistic-money', help='GCP project ID')
+        subparser.add_argument('--project-dir', default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               help='dbt project directory')
+    args = parser.parse_args()
+
+    bq_client = bigquery.Client(project=args.project)
+    if args.command == 'report':
+        print(report(bq_client, args.project, args.client, args.project_dir))
+    elif args.command == 'vars':
+        counts = source_row_counts(bq_client, args.project, args.client)
+        print(dbt_vars(decide(args.client, counts, row_threshold(args.project_dir))))
+
+
+if __name__ == "__main__":
+    main()
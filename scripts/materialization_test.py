@@ -0,0 +1,88 @@
+"""Tests for the core materialization decision and report, against a fake BigQuery client."""
+import re
+
+import pytest
+
+from materialization import decide, dbt_vars, report
+
+PROJECT = "holistic-money"
+THRESHOLD = 1000
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def result(self):
+        return self.rows
+
+
+class FakeBigQuery:
+    """Answers the source row count and core relation queries from dicts keyed by client."""
+
+    def __init__(self, source_rows, core_types):
+        self.source_rows = source_rows
+        self.core_types = core_types
+
+    def query(self, sql, job_config=None):
+        client = re.search(rf"`{PROJECT}\.(\w+?)(?:_core)?\.", sql).group(1)
+        if "__TABLES__" in sql:
+            if client not in self.source_rows:
+                raise LookupError(f"Not found: Dataset {PROJECT}:{client}")
+            return FakeResult([{"table_id": t, "row_count": n} for t, n in self.source_rows[client].items()])
+        return FakeResult([{"table_name": m, "table_type": t} for m, t in self.core_types.get(client, {}).items()])
+
+
+@pytest.fixture
+def project_dir(tmp_path):
+    (tmp_path / "dbt_project.yml").write_text(f"vars:\n  large_client_row_threshold: {THRESHOLD}\n")
+    return str(tmp_path)
+
+
+def report_rows(bq_client, clients, project_dir):
+    lines = report(bq_client, PROJECT, clients, project_dir).splitlines()[1:]
+    return {line.split()[0]: line for line in lines}
+
+
+@pytest.mark.parametrize("counts, materialized", [
+    ({"invoices": 999}, "view"),
+    ({"invoices": 600, "items": 400}, "table"),
+    ({}, "view"),
+])
+def test_decide_compares_total_rows_with_threshold(counts, materialized):
+    decision = decide("golden_hour", counts, THRESHOLD)
+    assert decision["materialized"] == materialized
+    assert decision["source_rows"] == sum(counts.values())
+    assert dbt_vars(decision) == f'{{"client_source_rows": {sum(counts.values())}}}'
+
+
+def test_report_switch_column(project_dir):
+    bq_client = FakeBigQuery(
+        source_rows={
+            "big_view": {"invoices": 5000},
+            "big_table": {"invoices": 5000},
+            "new_client": {"invoices": 5000},
+            "half_built": {"invoices": 10},
+        },
+        core_types={
+            "big_view": {"p_l_view": "VIEW", "budget_transformed": "VIEW"},
+            "big_table": {"p_l_view": "BASE TABLE", "budget_transformed": "BASE TABLE"},
+            "half_built": {"p_l_view": "VIEW"},
+        },
+    )
+    rows = report_rows(bq_client, ["big_view", "big_table", "new_client", "half_built"], project_dir)
+
+    assert rows["big_view"].split()[2:5] == ["view", "table", "yes"]
+    assert rows["big_table"].split()[2:5] == ["table", "table", "no"]
+    # Models that aren't built yet are created, not switched
+    assert rows["new_client"].split()[2:5] == ["-", "table", "no"]
+    assert rows["half_built"].split()[2:5] == ["view", "view", "no"]
+
+
+def test_report_keeps_going_after_a_client_fails(project_dir):
+    bq_client = FakeBigQuery(source_rows={"golden_hour": {"invoices": 10}}, core_types={"missing": {}})
+
+    rows = report_rows(bq_client, ["missing", "golden_hour"], project_dir)
+
+    assert "could not count source rows: Not found" in rows["missing"]
+    assert rows["golden_hour"].split()[3] == "view"
@@ -22,7 +22,13 @@ cd "$(dirname "$0")/.." || exit
 export DBT_CLIENT_DATASET=$CLIENT_NAME
 export DBT_BIGQUERY_PROJECT=$PROJECT_ID
 
+# Size the core models from the client's source row counts (see materialization.py)
+VARS=$(python scripts/materialization.py vars --client "$CLIENT_NAME" --project "$PROJECT_ID") || {
+    echo "Error: Could not count source rows for $CLIENT_NAME"
+    exit 1
+}
+
 # Run dbt models for this client
-dbt run --profiles-dir $HOME/.dbt --target service_account
+dbt run --profiles-dir $HOME/.dbt --target service_account --vars "$VARS"
 
 echo "Data warehouse refresh completed for $CLIENT_NAME in project $PROJECT_ID" 
\ No newline at end of file
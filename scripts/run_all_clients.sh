@@ -15,6 +15,9 @@ GCP_PROJECT="holistic_money"  # Replace with your actual GCP project ID
 # dbt profiles directory
 PROFILES_DIR="$HOME/.dbt"
 
+# Directory of this script, for materialization.py
+SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
+
 # Process each client
 for CLIENT in "${CLIENTS[@]}"; do
   echo "Processing client: $CLIENT"
@@ -23,8 +26,14 @@ for CLIENT in "${CLIENTS[@]}"; do
   export DBT_CLIENT_DATASET=$CLIENT
   export DBT_BIGQUERY_PROJECT=$GCP_PROJECT
   
+  # Size the core models from the client's source row counts (see materialization.py)
+  if ! VARS=$(python "$SCRIPT_DIR/materialization.py" vars --client "$CLIENT" --project "$GCP_PROJECT"); then
+    echo "Error: Could not count source rows for $CLIENT, skipping"
+    continue
+  fi
+  
   # Run dbt models for this client with the service_account target
-  dbt run --profiles-dir $PROFILES_DIR --target service_account --target service_account
+  dbt run --profiles-dir $PROFILES_DIR --target service_account --target service_account --vars "$VARS"
   
   echo "Completed processing for $CLIENT"
   echo "---------------------------------"
@@ -1,4 +1,5 @@
 from prefect import flow, task, get_run_logger
+from prefect.runtime import flow_run
 from prefect.tasks import task_input_hash
 from prefect_github.repository import GitHubRepository
 from prefect_gcp.credentials import GcpCredentials
@@ -8,11 +9,17 @@ import subprocess
 import shutil
 import tempfile
 import json
+import time
 import yaml
-from typing import List
+from typing import List, Optional
 from datetime import timedelta
 from pathlib import Path
 
+from dbt_tuning import profile_settings, record_run, run_outcome, settings_for_client
+from export_marts import export_client
+from materialization import dbt_vars, decide, row_threshold, source_row_counts
+from tracing import record_dbt_run, tracer
+
 # Load the GitHub repository block for deployment
 github_repository_block = GitHubRepository.load("holistic-money-dbt")
 
@@ -36,6 +43,48 @@ def check_dbt_installed():
         logger.error(f"Error verifying dbt installation: {str(e)}")
         raise
 
+@task
+def parse_dbt_project(dbt_project_dir: str, dbt_path: str, gcp_project: str) -> None:
+    """Write target/manifest.json with `dbt parse` so thread tuning can measure the DAG.
+
+    Deployments start from a fresh clone without target/, so otherwise the first
+    client of every run would have no manifest. Parsing doesn't connect to
+    BigQuery, so a throwaway oauth profile is enough.
+    """
+    logger = get_run_logger()
+    temp_profiles_dir = tempfile.mkdtemp(prefix="dbt_parse_profiles_")
+    try:
+        profiles_content = {
+            "holistic_money_dw": {
+                "target": "parse",
+                "outputs": {
+                    "parse": {
+                        "type": "bigquery",
+                        "method": "oauth",
+                        "project": gcp_project,
+                        "dataset": "default_client",
+                        "location": "US",
+                    }
+                }
+            }
+        }
+        with open(os.path.join(temp_profiles_dir, "profiles.yml"), "w") as f_profiles:
+            yaml.safe_dump(profiles_content, f_profiles, default_flow_style=False)
+
+        env = os.environ.copy()
+        env.setdefault("DBT_BIGQUERY_PROJECT", gcp_project)
+        env.setdefault("DBT_CLIENT_DATASET", "default_client")
+        result = subprocess.run(
+            [dbt_path, "parse", "--project-dir", dbt_project_dir, "--profiles-dir", temp_profiles_dir],
+            capture_output=True, text=True, env=env
+        )
+        if result.returncode != 0:
+            logger.warning(f"dbt parse failed, thread tuning will use defaults:\n{result.stdout[-2000:]}")
+        else:
+            logger.info("Parsed dbt project for thread tuning")
+    finally:
+        shutil.rmtree(temp_profiles_dir, ignore_errors=True)
+
 @task(
     retries=2,
     retry_delay_seconds=60,
@@ -43,18 +92,58 @@ def check_dbt_installed():
     cache_expiration=timedelta(hours=1),
     persist_result=False
 )
-def process_client(client: str, gcp_project: str, dbt_project_dir: str, dbt_path: str) -> None:
+def process_client(client: str, gcp_project: str, dbt_project_dir: str, dbt_path: str,
+                   tuning_uri: Optional[str] = None) -> None:
     """Process client using dbt via prefect_shell with a dynamic profiles.yml."""
+    trace_state = {}
+    try:
+        with tracer.span("client", client=client, gcp_project=gcp_project) as client_span:
+            return _run_client(client, gcp_project, dbt_project_dir, dbt_path, tuning_uri, client_span, trace_state)
+    finally:
+        # Enrich after the client span has closed so BigQuery job lookups don't count towards it
+        _enrich_trace(client, gcp_project, dbt_project_dir, client_span, trace_state)
+
+def _enrich_trace(client: str, gcp_project: str, dbt_project_dir: str, client_span, trace_state: dict) -> None:
+    """Break the dbt invocation down into phases, model nodes and warehouse jobs, including for failed runs."""
+    invocation = trace_state.get("invocation")
+    if not invocation or not tracer.exporters:
+        return
+    logger = get_run_logger()
+    with tracer.span("trace.enrich", client=client):
+        try:
+            bq_client = trace_state["credentials"].get_bigquery_client(project=gcp_project)
+            totals = record_dbt_run(
+                os.path.join(dbt_project_dir, "target", "run_results.json"), invocation, bq_client
+            )
+            for key, value in totals.items():
+                client_span.set_attribute(key, value)
+        except Exception as e:
+            logger.warning(f"Failed to record dbt trace spans for {client}: {str(e)}")
+
+def _run_client(client: str, gcp_project: str, dbt_project_dir: str, dbt_path: str,
+                tuning_uri: Optional[str], client_span, trace_state: dict) -> None:
+    """Write credentials and a tuned profile, run dbt, and record trace spans and run outcome for one client."""
     logger = get_run_logger()
     logger.info(f"Starting processing for client: {client}")
     
     temp_creds_file = None
     temp_profiles_dir = None
+    invocation = None
+    run_error = None
+    run_results_path = os.path.join(dbt_project_dir, "target", "run_results.json")
+
+    # Choose threads, timeout and bytes cap from the DAG width and this client's past runs
+    settings = settings_for_client(client, tuning_uri, dbt_project_dir)
+    logger.info(f"dbt settings for {client}: {profile_settings(settings)} ({'; '.join(settings['reasons'])})")
+    for key, value in profile_settings(settings).items():
+        client_span.set_attribute(key, value)
 
     try:
         # Load the GCP credentials block
+        credentials_start = time.time()
         logger.info("Loading GCP credentials from block 'holistic-money-credentials'...")
         gcp_credentials_block = GcpCredentials.load("holistic-money-credentials")
+        trace_state["credentials"] = gcp_credentials_block
         service_account_info = gcp_credentials_block.service_account_info.get_secret_value()
 
         # Create a temporary file to store the credentials JSON
@@ -62,6 +151,7 @@ def process_client(client: str, gcp_project: str, dbt_project_dir: str, dbt_path
             f_creds.write(json.dumps(service_account_info))
             temp_creds_file = f_creds.name
         logger.info(f"GCP credentials written to temporary file: {temp_creds_file}")
+        tracer.record("load_credentials", credentials_start, time.time())
 
         # Define the standard profiles.yml content using the temp creds file path
         profiles_content = {
@@ -74,16 +164,16 @@ def process_client(client: str, gcp_project: str, dbt_project_dir: str, dbt_path
                         "project": gcp_project,
                         "dataset": client,
                         "keyfile": temp_creds_file, # Use the temp creds file path directly
-                        "threads": 4,
-                        "timeout_seconds": 300,
                         "location": "US",
-                        "priority": "interactive"
+                        "priority": "interactive",
+                        **profile_settings(settings),
                     }
                 }
             }
         }
 
         # Create a temporary directory to store profiles.yml
+        profile_start = time.time()
         temp_profiles_dir = tempfile.mkdtemp(prefix="dbt_profiles_")
         profiles_file_path = os.path.join(temp_profiles_dir, "profiles.yml")
         
@@ -93,6 +183,7 @@ def process_client(client: str, gcp_project: str, dbt_project_dir: str, dbt_path
             
         logger.info(f"Created profiles.yml at: {profiles_file_path}")
         logger.info(f"Using profiles directory: {temp_profiles_dir}")
+        tracer.record("write_profile", profile_start, time.time())
         
         # Debug: Print file contents and verify it exists
         logger.info(f"Verifying profiles.yml exists: {os.path.exists(profiles_file_path)}")
@@ -102,8 +193,22 @@ def process_client(client: str, gcp_project: str, dbt_project_dir: str, dbt_path
         # List directory contents to verify
         logger.info(f"Directory contents of {temp_profiles_dir}: {os.listdir(temp_profiles_dir)}")
         
+        # Large clients get partitioned, clustered core tables instead of views. Without the
+        # count dbt would rebuild them as views, so fail here and let the task retry instead
+        try:
+            decision = decide(
+                client,
+                source_row_counts(gcp_credentials_block.get_bigquery_client(project=gcp_project), gcp_project, client),
+                row_threshold(dbt_project_dir),
+            )
+        except Exception as e:
+            raise RuntimeError(f"Could not count source rows for {client}, not running dbt without them: {str(e)}") from e
+        logger.info(f"Core models for {client} will be {decision['materialized']}s: {decision['reason']}")
+        client_span.set_attribute("core_materialized", decision["materialized"])
+        vars_arg = f" --vars '{dbt_vars(decision)}'"
+
         # Construct the shell command for ShellOperation
-        command = f'{dbt_path} run --project-dir "{dbt_project_dir}" --profiles-dir "{temp_profiles_dir}" --target service_account --debug'
+        command = f'{dbt_path} run --project-dir "{dbt_project_dir}" --profiles-dir "{temp_profiles_dir}" --target service_account{vars_arg} --debug'
         logger.info(f"Executing command: {command}")
 
         # Run the command using ShellOperation
@@ -116,7 +221,9 @@ def process_client(client: str, gcp_project: str, dbt_project_dir: str, dbt_path
                 "DBT_CLIENT_DATASET": client,          # 👈 add this
             }
         )
-        result = shell_op.run()
+        with tracer.span("dbt.invocation", command="run") as invocation:
+            trace_state["invocation"] = invocation
+            result = shell_op.run()
         logger.info(f"Shell operation output:\n{result}")
 
         logger.info(f"Successfully completed processing for {client}")
@@ -125,8 +232,19 @@ def process_client(client: str, gcp_project: str, dbt_project_dir: str, dbt_path
     except Exception as e:
         # Log the full exception details
         logger.error(f"Error processing client {client}", exc_info=True)
+        run_error = str(e)
         raise
     finally:
+        # Record the settings used alongside the outcome so the next choice can build on it
+        if invocation and tuning_uri:
+            try:
+                outcome = run_outcome(
+                    run_results_path, "error" if run_error else "success", run_error, invocation.start
+                )
+                record_run(tuning_uri, client, settings, outcome)
+            except Exception as e:
+                logger.warning(f"Failed to record dbt run outcome for {client}: {str(e)}")
+
         # Clean up the temporary files
         if temp_creds_file and os.path.exists(temp_creds_file):
             logger.info(f"Cleaning up temporary credentials file: {temp_creds_file}")
@@ -135,6 +253,21 @@ def process_client(client: str, gcp_project: str, dbt_project_dir: str, dbt_path
             logger.info(f"Cleaning up temporary profiles directory: {temp_profiles_dir}")
             shutil.rmtree(temp_profiles_dir)
 
+@task(retries=1, retry_delay_seconds=60)
+def export_client_marts(client: str, gcp_project: str, export_uri: str) -> dict:
+    """Export the client's changed mart months to partitioned Parquet files."""
+    logger = get_run_logger()
+    logger.info(f"Exporting marts for client {client} to {export_uri}")
+
+    gcp_credentials_block = GcpCredentials.load("holistic-money-credentials")
+    bq_client = gcp_credentials_block.get_bigquery_client(project=gcp_project)
+
+    with tracer.span("export", client=client) as export_span:
+        summary = export_client(bq_client, gcp_project, client, export_uri)
+        export_span.set_attribute("months", len(summary["months"]))
+    logger.info(f"Export summary for {client}: {summary}")
+    return summary
+
 @flow(
     name="Process All Clients",
     description="Process all clients using dbt",
@@ -151,8 +284,26 @@ def process_all_clients(
         "western_holistic_med"
     ],
     gcp_project: str = "holistic-money",
+    export_uri: Optional[str] = None,
+    trace_path: Optional[str] = None,
+    trace_collector_url: Optional[str] = None,
+    tuning_uri: Optional[str] = None,
 ) -> None:
     """Process all clients using dbt."""
+    tracer.configure(file_path=trace_path, collector_url=trace_collector_url)
+    try:
+        with tracer.span("flow", clients=len(clients)) as flow_span:
+            # Time between the scheduled start and this run actually starting
+            scheduled_start = flow_run.scheduled_start_time
+            if scheduled_start:
+                tracer.record("prefect.scheduling", scheduled_start.timestamp(), flow_span.start)
+            _process_clients(clients, gcp_project, export_uri, tuning_uri)
+    finally:
+        tracer.flush()
+
+def _process_clients(clients: List[str], gcp_project: str, export_uri: Optional[str],
+                     tuning_uri: Optional[str]) -> None:
+    """Run dbt, then the optional export, for each client in turn."""
     logger = get_run_logger()
     logger.info(f"Starting flow to process {len(clients)} clients")
     
@@ -163,16 +314,29 @@ def process_all_clients(
     script_dir = Path(__file__).parent.absolute()
     dbt_project_dir = str(script_dir.parent)
     logger.info(f"Using dbt project directory: {dbt_project_dir}")
+
+    # Tuning needs a durable run history; without one every client keeps the default settings
+    if tuning_uri:
+        parse_dbt_project(dbt_project_dir, dbt_path, gcp_project)
+    else:
+        logger.info("No tuning_uri set, dbt thread/timeout tuning is disabled")
     
     # Process clients sequentially
     for client in clients:
         try:
             # Pass only needed params - profiles_dir removed
-            process_client(client, gcp_project, dbt_project_dir, dbt_path)
+            process_client(client, gcp_project, dbt_project_dir, dbt_path, tuning_uri)
         except Exception as e:
             logger.error(f"Failed to process client {client}: {str(e)}")
             # Continue processing other clients despite failure
             continue
+
+        # Export after a successful run so snapshots always reflect finished models
+        if export_uri:
+            try:
+                export_client_marts(client, gcp_project, export_uri)
+            except Exception as e:
+                logger.error(f"Failed to export marts for client {client}: {str(e)}")
     
     logger.info("Completed processing all clients")
 
@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+"""Cached read API over the per-client marts for dashboards.
+
+Answers the common dashboard queries from an in-memory LRU/TTL cache instead
+of re-executing the view chain in BigQuery on every panel refresh. Entries are
+keyed by client, query and parameters, and are dropped as soon as the blend's
+`last_refreshed` (or the latest comment) moves past what the entry was built from.
+"""
+import argparse
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlparse
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Client names end up in SQL identifiers, so only plain dataset names are accepted
+CLIENT_PATTERN = re.compile(r"^[A-Za-z0-9_]+$")
+
+# Queries use @name placeholders, which both BigQuery and SQLite understand.
+# {blend}, {comments}, {with_comments} and {profit} are replaced by the backend's
+# relation names for the client being queried.
+QUERIES = {
+    "pl_by_month": """
+        SELECT *
+        FROM {profit}
+        ORDER BY txnDate
+    """,
+    "budget_vs_actual": """
+        SELECT
+            parent_account,
+            sub_account,
+            child_account,
+            classification,
+            account_type,
+            SUM(actual) AS actual,
+            SUM(budget_amount) AS budget_amount,
+            SUM(actual) - SUM(budget_amount) AS variance
+        FROM {blend}
+        WHERE txnDate BETWEEN @start_date AND @end_date
+        GROUP BY parent_account, sub_account, child_account, classification, account_type
+        ORDER BY parent_account, sub_account, child_account
+    """,
+    "latest_comments": """
+        SELECT
+            txnDate,
+            parent_account,
+            sub_account,
+            child_account,
+            comment_text,
+            comment_by,
+            comment_date
+        FROM {with_comments}
+        WHERE comment_text IS NOT NULL
+        ORDER BY comment_date DESC
+        LIMIT @limit
+    """,
+}
+
+# Default parameters for each query, also used to coerce query-string values
+QUERY_DEFAULTS = {
+    "pl_by_month": {},
+    "budget_vs_actual": {"start_date": date(1900, 1, 1), "end_date": date(2999, 12, 31)},
+    "latest_comments": {"limit": 50},
+}
+
+WATERMARK_QUERY = """
+    SELECT
+        (SELECT MAX(last_refreshed) FROM {blend}) AS last_refreshed,
+        (SELECT MAX(updated_at) FROM {comments}) AS last_comment
+"""
+
+
+class BigQueryBackend:
+    """Runs mart queries against the client's `<client>_marts` dataset in BigQuery."""
+
+    def __init__(self, project: str, location: str = "US", client=None):
+        # Imported here so the SQLite backend works without the BigQuery client installed
+        from google.cloud import bigquery
+
+        self.bigquery = bigquery
+        self.project = project
+        self.client = client or bigquery.Client(project=project, location=location)
+
+    def relation(self, client: str, model: str) -> str:
+        # dbt appends the `+schema: marts` suffix to the client dataset
+        return f"`{self.project}.{client}_marts.{model}`"
+
+    def execute(self, sql: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        query_params = [
+            self.bigquery.ScalarQueryParameter(name, _bigquery_type(value), value)
+            for name, value in params.items()
+        ]
+        job_config = self.bigquery.QueryJobConfig(query_parameters=query_params)
+        rows = self.client.query(sql, job_config=job_config).result()
+        return [dict(row.items()) for row in rows]
+
+
+class SQLiteBackend:
+    """Runs mart queries against a local SQLite database, for tests and local development.
+
+    Each mart is expected as a table named `<client>_marts__<model>`.
+    """
+
+    def __init__(self, path: str = ":memory:"):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+
+    def relation(self, client: str, model: str) -> str:
+        return f'"{client}_marts__{model}"'
+
+    def execute(self, sql: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        with self._lock:
+            cursor = self.connection.execute(sql, params)
+            return [dict(row) for row in cursor.fetchall()]
+
+
+def _bigquery_type(value: Any) -> str:
+    """Map a Python parameter value to its BigQuery scalar type."""
+    if isinstance(value, bool):
+        return "BOOL"
+    if isinstance(value, int):
+        return "INT64"
+    if isinstance(value, float):
+        return "FLOAT64"
+    if isinstance(value, datetime):
+        return "TIMESTAMP"
+    if isinstance(value, date):
+        return "DATE"
+    return "STRING"
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after `ttl_seconds`."""
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 900):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple, watermark: Any) -> Optional[Any]:
+        """Return the cached value, or None if missing, expired or built from an older watermark."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                stored_at, stored_watermark, value = entry
+                if time.monotonic() - stored_at <= self.ttl_seconds and stored_watermark == watermark:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Tuple, watermark: Any, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic(), watermark, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, client: Optional[str] = None) -> None:
+        """Drop every entry, or only the entries for one client."""
+        with self._lock:
+            if client is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == client]:
+                del self._entries[key]
+
+
+class MartsReader:
+    """Serves dashboard queries for each client through a TTL cache.
+
+    The watermark (latest `last_refreshed` in the blend and latest comment
+    update) is itself only re-checked every `watermark_interval` seconds, so a
+    burst of panel refreshes costs at most one small query per client.
+    """
+
+    def __init__(self, backend, cache: Optional[TTLCache] = None, watermark_interval: float = 60):
+        self.backend = backend
+        self.cache = cache or TTLCache()
+        self.watermark_interval = watermark_interval
+        self._watermarks: Dict[str, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def _relations(self, client: str) -> Dict[str, str]:
+        return {
+            "blend": self.backend.relation(client, "materialized_pl_budget_blend"),
+            "comments": self.backend.relation(client, "financial_comments"),
+            "with_comments": self.backend.relation(client, "pl_budget_with_comments"),
+            "profit": self.backend.relation(client, "profit_by_month"),
+        }
+
+    def watermark(self, client: str) -> Tuple:
+        """Return the client's current data watermark, re-reading it at most once per interval."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._watermarks.get(client)
+            if cached and now - cached[0] < self.watermark_interval:
+                return cached[1]
+
+        rows = self.backend.execute(WATERMARK_QUERY.format(**self._relations(client)), {})
+        row = rows[0] if rows else {}
+        watermark = (row.get("last_refreshed"), row.get("last_comment"))
+
+        with self._lock:
+            self._watermarks[client] = (now, watermark)
+        return watermark
+
+    def query(self, client: str, name: str, **params) -> List[Dict[str, Any]]:
+        """Run one of the named QUERIES for a client, answering from cache when possible."""
+        if name not in QUERIES:
+            raise ValueError(f"Unknown query '{name}'. Available: {', '.join(sorted(QUERIES))}")
+        if not CLIENT_PATTERN.match(client):
+            raise ValueError(f"Invalid client name '{client}'")
+
+        merged = {**QUERY_DEFAULTS[name], **params}
+        key = (client, name, tuple(sorted(merged.items())))
+        watermark = self.watermark(client)
+
+        rows = self.cache.get(key, watermark)
+        if rows is not None:
+            return rows
+
+        logging.info(f"Cache miss for {client}/{name}, querying backend")
+        rows = self.backend.execute(QUERIES[name].format(**self._relations(client)), merged)
+        self.cache.put(key, watermark, rows)
+        return rows
+
+    def pl_by_month(self, client: str) -> List[Dict[str, Any]]:
+        return self.query(client, "pl_by_month")
+
+    def budget_vs_actual(self, client: str, start_date: date, end_date: date) -> List[Dict[str, Any]]:
+        return self.query(client, "budget_vs_actual", start_date=start_date, end_date=end_date)
+
+    def latest_comments(self, client: str, limit: int = 50) -> List[Dict[str, Any]]:
+        return self.query(client, "latest_comments", limit=limit)
+
+
+def _coerce_params(name: str, raw: Dict[str, List[str]]) -> Dict[str, Any]:
+    """Convert query-string values to the types of the query's defaults."""
+    params = {}
+    for key, default in QUERY_DEFAULTS[name].items():
+        if key not in raw:
+            continue
+        value = raw[key][0]
+        if isinstance(default, date):
+            params[key] = date.fromisoformat(value)
+        else:
+            params[key] = type(default)(value)
+    return params
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def is_allowed_client(client: str, clients: Optional[Sequence[str]] = None) -> bool:
+    """Return whether a client name is a plain dataset name and, if given, in the allow-list."""
+    if not CLIENT_PATTERN.match(client):
+        return False
+    return clients is None or client in clients
+
+
+def make_handler(reader: MartsReader, clients: Optional[Sequence[str]] = None):
+    """Build a request handler serving GET /<client>/<query>?param=value as JSON.
+
+    Only clients matching CLIENT_PATTERN, and in `clients` when given, are served.
+    """
+
+    class MartsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            if len(parts) != 2 or parts[1] not in QUERIES:
+                self._send(404, {"error": f"Expected /<client>/<query>, queries: {sorted(QUERIES)}"})
+                return
+            client, name = parts
+            if not is_allowed_client(client, clients):
+                self._send(404, {"error": f"Unknown client '{client}'"})
+                return
+            try:
+                rows = reader.query(client, name, **_coerce_params(name, parse_qs(url.query)))
+            except ValueError as e:
+                self._send(400, {"error": str(e)})
+                return
+            except Exception as e:
+                logging.error(f"Error serving {client}/{name}", exc_info=True)
+                self._send(500, {"error": str(e)})
+                return
+            self._send(200, rows)
+
+        def _send(self, status: int, payload: Any) -> None:
+            body = json.dumps(payload, default=_json_default).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logging.info(format % args)
+
+    return MartsHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve cached dashboard queries over the client marts')
+    parser.add_argument('--project', default='holistic-money', help='GCP project ID')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to bind')
+    parser.add_argument('--port', type=int, default=8080, help='Port to bind')
+    parser.add_argument('--ttl', type=float, default=900, help='Maximum age of a cached result in seconds')
+    parser.add_argument('--max-entries', type=int, default=512, help='Maximum number of cached results')
+    parser.add_argument('--watermark-interval', type=float, default=60,
+                        help='Seconds between last_refreshed checks per client')
+    parser.add_argument('--sqlite', help='Serve from a local SQLite database instead of BigQuery')
+    parser.add_argument('--client', action='append', dest='clients',
+                        help='Client allowed to be served (repeatable, defaults to any valid name)')
+    args = parser.parse_args()
+
+    backend = SQLiteBackend(args.sqlite) if args.sqlite else BigQueryBackend(args.project)
+    reader = MartsReader(
+        backend,
+        cache=TTLCache(max_entries=args.max_entries, ttl_seconds=args.ttl),
+        watermark_interval=args.watermark_interval,
+    )
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(reader, args.clients))
+    logging.info(f"Serving marts on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
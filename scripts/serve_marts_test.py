@@ -0,0 +1,93 @@
+"""Tests for the cached marts reader, run against the SQLite backend."""
+import pytest
+
+from serve_marts import MartsReader, SQLiteBackend, TTLCache, is_allowed_client
+
+CLIENT = "golden_hour"
+
+
+@pytest.fixture
+def backend():
+    backend = SQLiteBackend(":memory:")
+    db = backend.connection
+    db.execute(f"""
+        CREATE TABLE "{CLIENT}_marts__materialized_pl_budget_blend" (
+            entry_id TEXT, txnDate TEXT, parent_account TEXT, sub_account TEXT, child_account TEXT,
+            classification TEXT, account_type TEXT, actual REAL, budget_amount REAL, last_refreshed TEXT
+        )
+    """)
+    db.execute(f'CREATE TABLE "{CLIENT}_marts__financial_comments" (entry_id TEXT, comment_text TEXT, updated_at TEXT)')
+    db.execute(f'CREATE TABLE "{CLIENT}_marts__profit_by_month" (txnDate TEXT, net_profit_actual REAL)')
+    db.execute(f"""
+        CREATE TABLE "{CLIENT}_marts__pl_budget_with_comments" (
+            txnDate TEXT, parent_account TEXT, sub_account TEXT, child_account TEXT,
+            comment_text TEXT, comment_by TEXT, comment_date TEXT
+        )
+    """)
+    db.execute(f"""
+        INSERT INTO "{CLIENT}_marts__materialized_pl_budget_blend" VALUES
+            ('e1', '2025-01-01', 'Income', 'Sales', NULL, 'Revenue', 'Income', 100, 80, '2025-02-01 00:00:00')
+    """)
+    db.execute(f"INSERT INTO \"{CLIENT}_marts__financial_comments\" VALUES ('e1', 'Looks good', '2025-02-01 00:00:00')")
+    db.execute(f"INSERT INTO \"{CLIENT}_marts__profit_by_month\" VALUES ('2025-01-01', 100)")
+    return backend
+
+
+def make_reader(backend, max_entries=512):
+    # Re-read the watermark on every call so invalidation is immediate
+    return MartsReader(backend, cache=TTLCache(max_entries=max_entries), watermark_interval=0)
+
+
+def test_second_call_is_served_from_cache(backend):
+    reader = make_reader(backend)
+
+    first = reader.pl_by_month(CLIENT)
+    second = reader.pl_by_month(CLIENT)
+
+    assert second == first == [{"txnDate": "2025-01-01", "net_profit_actual": 100}]
+    assert reader.cache.misses == 1
+    assert reader.cache.hits == 1
+
+
+@pytest.mark.parametrize("update", [
+    f"UPDATE \"{CLIENT}_marts__materialized_pl_budget_blend\" SET actual = 150, last_refreshed = '2025-03-01 00:00:00'",
+    f"UPDATE \"{CLIENT}_marts__financial_comments\" SET updated_at = '2025-03-01 00:00:00'",
+])
+def test_watermark_change_invalidates_entry(backend, update):
+    reader = make_reader(backend)
+    reader.budget_vs_actual(CLIENT, "2025-01-01", "2025-12-31")
+
+    backend.connection.execute(update)
+    rows = reader.budget_vs_actual(CLIENT, "2025-01-01", "2025-12-31")
+
+    assert reader.cache.hits == 0
+    assert reader.cache.misses == 2
+    assert rows[0]["actual"] == backend.execute(
+        f'SELECT actual FROM "{CLIENT}_marts__materialized_pl_budget_blend"', {}
+    )[0]["actual"]
+
+
+def test_least_recently_used_entry_is_evicted(backend):
+    reader = make_reader(backend, max_entries=2)
+    reader.latest_comments(CLIENT, limit=1)
+    reader.latest_comments(CLIENT, limit=2)
+    reader.latest_comments(CLIENT, limit=1)  # hit, makes limit=2 the least recently used
+    reader.latest_comments(CLIENT, limit=3)  # evicts limit=2
+
+    reader.latest_comments(CLIENT, limit=1)
+    assert reader.cache.hits == 2
+    reader.latest_comments(CLIENT, limit=2)
+    assert reader.cache.hits == 2
+    assert reader.cache.misses == 4
+
+
+@pytest.mark.parametrize("client", ["golden_hour`; DROP TABLE x; --", 'a"b', "a.b", ""])
+def test_invalid_client_names_are_rejected(backend, client):
+    assert not is_allowed_client(client)
+    with pytest.raises(ValueError):
+        make_reader(backend).pl_by_month(client)
+
+
+def test_allow_list_limits_clients():
+    assert is_allowed_client("golden_hour", ["golden_hour"])
+    assert not is_allowed_client("bb_design", ["golden_hour"])
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""Lightweight tracing for the nightly client runs.
+
+Spans nest as flow -> client task -> dbt invocation phase -> model node -> warehouse
+job, and carry timing plus byte counts. Finished spans are buffered and written
+on flush to a JSON lines file and/or an OpenTelemetry collector (OTLP/HTTP JSON).
+
+Render a per-client waterfall and critical path from a trace file with:
+
+    python tracing.py report traces.jsonl
+"""
+import argparse
+import contextvars
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed unit of work. Times are Unix epoch seconds."""
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 start: Optional[float] = None, attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start = start if start is not None else time.time()
+        self.end: Optional[float] = None
+        self.attributes = dict(attributes or {})
+        self.status = "ok"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end or time.time()) - self.start) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "end": self.end,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class FileExporter:
+    """Appends spans to a JSON lines file."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans: List[Span]) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, "a") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+
+class CollectorExporter:
+    """Posts spans to an OpenTelemetry collector's OTLP/HTTP JSON endpoint."""
+
+    def __init__(self, url: str, service_name: str = "holistic-money-dbt", timeout: float = 10):
+        self.url = url.rstrip("/")
+        if not self.url.endswith("/v1/traces"):
+            self.url += "/v1/traces"
+        self.service_name = service_name
+        self.timeout = timeout
+
+    @staticmethod
+    def _otlp_value(value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    def _otlp_span(self, span: Span) -> Dict[str, Any]:
+        otlp = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(int(span.start * 1e9)),
+            "endTimeUnixNano": str(int((span.end or span.start) * 1e9)),
+            "attributes": [
+                {"key": key, "value": self._otlp_value(value)}
+                for key, value in span.attributes.items() if value is not None
+            ],
+            "status": {"code": 2 if span.status == "error" else 1},
+        }
+        if span.parent_id:
+            otlp["parentSpanId"] = span.parent_id
+        return otlp
+
+    def export(self, spans: List[Span]) -> None:
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": self.service_name}}
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": "holistic_money_dbt.tracing"},
+                    "spans": [self._otlp_span(span) for span in spans],
+                }],
+            }]
+        }
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+class Tracer:
+    """Creates nested spans and buffers them until flush()."""
+
+    def __init__(self):
+        self.exporters: List = []
+        self._finished: List[Span] = []
+        self._lock = threading.Lock()
+
+    def configure(self, file_path: Optional[str] = None, collector_url: Optional[str] = None) -> None:
+        """Set where spans are exported. With neither, spans are recorded but discarded on flush."""
+        self.exporters = []
+        if file_path:
+            self.exporters.append(FileExporter(file_path))
+        if collector_url:
+            self.exporters.append(CollectorExporter(collector_url))
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def _new_span(self, name: str, parent: Optional[Span], start: Optional[float],
+                  attributes: Dict[str, Any]) -> Span:
+        trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        return Span(name, trace_id, parent.span_id if parent else None, start, attributes)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Time the enclosed block as a child of the current span."""
+        span = self._new_span(name, self.current_span(), None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.status = "error"
+            span.set_attribute("error", str(e))
+            raise
+        finally:
+            _current_span.reset(token)
+            self.finish(span)
+
+    def record(self, name: str, start: float, end: float, parent: Optional[Span] = None,
+               **attributes) -> Span:
+        """Record a span whose timing was measured elsewhere, e.g. from dbt or BigQuery."""
+        span = self._new_span(name, parent or self.current_span(), start, attributes)
+        self.finish(span, end)
+        return span
+
+    def finish(self, span: Span, end: Optional[float] = None) -> None:
+        span.end = end if end is not None else time.time()
+        with self._lock:
+            self._finished.append(span)
+
+    def flush(self) -> None:
+        """Send buffered spans to every exporter. Export failures are logged, not raised."""
+        with self._lock:
+            spans, self._finished = self._finished, []
+        if not spans:
+            return
+        for exporter in self.exporters:
+            try:
+                exporter.export(spans)
+            except Exception as e:
+                logging.warning(f"Failed to export {len(spans)} spans with {type(exporter).__name__}: {e}")
+
+
+tracer = Tracer()
+
+
+def _parse_timestamp(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def _as_epoch(value: Optional[datetime]) -> Optional[float]:
+    return value.timestamp() if value else None
+
+
+def record_dbt_run(run_results_path: str, invocation: Span, bq_client=None, location: str = "US") -> Dict[str, int]:
+    """Record dbt phases, model nodes and warehouse jobs from run_results.json under `invocation`.
+
+    Startup (parse, compile, connection setup) and teardown are the parts of the
+    invocation before the first and after the last node. When a BigQuery client
+    is given, each node's job is looked up so queueing time shows up separately
+    from execution. Returns the summed byte counts across nodes.
+    """
+    totals = {"bytes_processed": 0, "bytes_billed": 0, "slot_ms": 0}
+    if not os.path.exists(run_results_path) or os.path.getmtime(run_results_path) < invocation.start:
+        logging.warning(f"No run results from this invocation at {run_results_path}, skipping dbt node spans")
+        return totals
+
+    with open(run_results_path) as f:
+        run_results = json.load(f)
+
+    nodes = []
+    for result in run_results.get("results", []):
+        timings = {t["name"]: t for t in result.get("timing", [])}
+        starts = [_parse_timestamp(t.get("started_at")) for t in timings.values()]
+        ends = [_parse_timestamp(t.get("completed_at")) for t in timings.values()]
+        starts = [s for s in starts if s]
+        ends = [e for e in ends if e]
+        if starts and ends:
+            nodes.append((min(starts), max(ends), result, timings))
+
+    if not nodes:
+        return totals
+
+    first_start = min(n[0] for n in nodes)
+    last_end = max(n[1] for n in nodes)
+    invocation_end = invocation.end or time.time()
+    tracer.record("dbt.startup", invocation.start, first_start, parent=invocation)
+    execute = tracer.record("dbt.execute", first_start, last_end, parent=invocation, nodes=len(nodes))
+    tracer.record("dbt.teardown", last_end, max(last_end, invocation_end), parent=invocation)
+
+    for start, end, result, timings in nodes:
+        adapter_response = result.get("adapter_response") or {}
+        node_bytes = {key: adapter_response.get(key) for key in totals}
+        for key, value in node_bytes.items():
+            totals[key] += value or 0
+
+        node = tracer.record(
+            "dbt.node",
+            start,
+            end,
+            parent=execute,
+            unique_id=result.get("unique_id"),
+            status=result.get("status"),
+            job_id=adapter_response.get("job_id"),
+            **node_bytes,
+        )
+        for phase, timing in timings.items():
+            phase_start = _parse_timestamp(timing.get("started_at"))
+            phase_end = _parse_timestamp(timing.get("completed_at"))
+            if phase_start and phase_end:
+                tracer.record(
+                    f"dbt.node.{phase}", phase_start, phase_end, parent=node, unique_id=result.get("unique_id")
+                )
+
+        if bq_client is not None and adapter_response.get("job_id"):
+            _record_bigquery_job(bq_client, adapter_response["job_id"], location, node)
+
+    return totals
+
+
+def _record_bigquery_job(bq_client, job_id: str, location: str, parent: Span) -> None:
+    """Record a warehouse job span with its queueing time split out. Best effort."""
+    try:
+        job = bq_client.get_job(job_id, location=location)
+    except Exception as e:
+        logging.warning(f"Could not look up BigQuery job {job_id}: {e}")
+        return
+
+    created, started, ended = _as_epoch(job.created), _as_epoch(job.started), _as_epoch(job.ended)
+    if not (created and ended):
+        return
+    job_span = tracer.record(
+        "bigquery.job",
+        created,
+        ended,
+        parent=parent,
+        job_id=job_id,
+        bytes_processed=getattr(job, "total_bytes_processed", None),
+        bytes_billed=getattr(job, "total_bytes_billed", None),
+        slot_ms=getattr(job, "slot_millis", None),
+        cache_hit=getattr(job, "cache_hit", None),
+    )
+    if started:
+        tracer.record("bigquery.job.queued", created, started, parent=job_span)
+        tracer.record("bigquery.job.running", started, ended, parent=job_span)
+
+
+def load_spans(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def critical_path(span: Dict[str, Any], children: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Return the chain of leaf spans that determined when `span` finished.
+
+    Starting from the child that finished last, each step goes back to the sibling
+    that finished latest before it started, then the chain is expanded into each
+    child's own critical path.
+    """
+    kids = children.get(span["span_id"])
+    if not kids:
+        return [span]
+
+    def end(s):
+        return s["end"] or s["start"]
+
+    chain = [max(kids, key=end)]
+    while True:
+        before = [s for s in kids if end(s) <= chain[-1]["start"] + 1e-6 and s is not chain[-1]]
+        if not before:
+            break
+        chain.append(max(before, key=end))
+
+    path = []
+    for child in reversed(chain):
+        path.extend(critical_path(child, children))
+    return path
+
+
+def render_flow_header(spans: List[Dict[str, Any]]) -> List[str]:
+    """Summarise the flow span: Prefect scheduling delay and when each client started."""
+    flow = next((s for s in spans if s["name"] == "flow"), None)
+    if flow is None:
+        return []
+    scheduling = next((s for s in spans if s["name"] == "prefect.scheduling"), None)
+    delay = f"{scheduling['duration_ms'] / 1000:.1f}s" if scheduling else "unknown"
+    lines = [f"=== flow  {flow['duration_ms'] / 1000:.1f}s  [{flow['status']}]  scheduling delay {delay}"]
+    for client in sorted((s for s in spans if s["name"] == "client"), key=lambda s: s["start"]):
+        lines.append(
+            f"  {client['attributes'].get('client', '-'):<28} starts +{client['start'] - flow['start']:8.1f}s"
+            f"  runs {client['duration_ms'] / 1000:8.1f}s  [{client['status']}]"
+        )
+    lines.append("")
+    return lines
+
+
+def render_waterfall(spans: List[Dict[str, Any]], width: int = 50, trace_id: Optional[str] = None) -> str:
+    """Render the flow header, then one waterfall and critical path per client span
+    (or per root span without clients).
+
+    Defaults to the most recent trace in the file.
+    """
+    if not spans:
+        return "No spans found"
+    if not trace_id:
+        trace_id = max(spans, key=lambda s: s["start"])["trace_id"]
+    spans = [s for s in spans if s["trace_id"] == trace_id]
+    children = defaultdict(list)
+    for span in spans:
+        if span["parent_id"]:
+            children[span["parent_id"]].append(span)
+    for siblings in children.values():
+        siblings.sort(key=lambda s: s["start"])
+
+    roots = [s for s in spans if s["name"] == "client"] or [s for s in spans if not s["parent_id"]]
+    lines = render_flow_header(spans)
+    for root in sorted(roots, key=lambda s: s["start"]):
+        total = max((root["end"] or root["start"]) - root["start"], 1e-9)
+        title = root["attributes"].get("client", root["name"])
+        lines.append(f"=== {title}  {root['duration_ms'] / 1000:.1f}s  [{root['status']}]")
+
+        def label(span):
+            detail = span["attributes"].get("unique_id") or span["attributes"].get("job_id")
+            return f"{span['name']} {detail}" if detail else span["name"]
+
+        def walk(span, depth):
+            offset = int((span["start"] - root["start"]) / total * width)
+            length = max(1, int(((span["end"] or span["start"]) - span["start"]) / total * width))
+            bar = " " * max(0, offset) + "#" * min(length, width - max(0, offset))
+            billed = span["attributes"].get("bytes_billed")
+            suffix = f"  {billed / 1e6:.1f}MB billed" if billed else ""
+            lines.append(f"{'  ' * depth}{label(span):<{60 - 2 * depth}} |{bar:<{width}}| {span['duration_ms'] / 1000:7.2f}s{suffix}")
+            for child in children.get(span["span_id"], []):
+                walk(child, depth + 1)
+
+        walk(root, 0)
+        path = critical_path(root, children)
+        lines.append("Critical path: " + " -> ".join(
+            f"{label(s)} ({s['duration_ms'] / 1000:.1f}s)" for s in path
+        ))
+        lines.append("")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect traces from client runs')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    report = subparsers.add_parser('report', help='Render per-client waterfall and critical path')
+    report.add_argument('trace_file', help='JSON lines trace file written by the flow')
+    report.add_argument('--trace-id', help='Trace to show (defaults to the most recent)')
+    report.add_argument('--width', type=int, default=50, help='Width of the waterfall bars')
+    args = parser.parse_args()
+
+    if args.command == 'report':
+        print(render_waterfall(load_spans(args.trace_file), args.width, args.trace_id))
+
+
+if __name__ == "__main__":
+    main()
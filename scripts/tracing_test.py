@@ -0,0 +1,87 @@
+"""Tests for the trace report, built from spans recorded through a Tracer."""
+import re
+from collections import defaultdict
+
+import pytest
+
+from tracing import Tracer, critical_path, load_spans, render_waterfall
+
+T0 = 1_750_000_000.0
+
+
+@pytest.fixture
+def tracer(tmp_path):
+    tracer = Tracer()
+    tracer.configure(file_path=str(tmp_path / "traces.jsonl"))
+    return tracer
+
+
+def flushed(tracer):
+    tracer.flush()
+    return load_spans(tracer.exporters[0].path)
+
+
+def children_of(spans):
+    children = defaultdict(list)
+    for span in spans:
+        if span["parent_id"]:
+            children[span["parent_id"]].append(span)
+    return children
+
+
+def record_run(tracer, start, client="golden_hour"):
+    """Record a flow with one client whose models overlap like a threaded dbt run."""
+    flow = tracer.record("flow", start, start + 110)
+    tracer.record("prefect.scheduling", start, start + 5, parent=flow)
+    client_span = tracer.record("client", start + 10, start + 110, parent=flow, client=client)
+    tracer.record("load_credentials", start + 10, start + 12, parent=client_span)
+    # b overlaps a but finishes earlier, so the chain to c goes through a
+    tracer.record("dbt.node", start + 12, start + 50, parent=client_span, unique_id="model.a")
+    tracer.record("dbt.node", start + 20, start + 40, parent=client_span, unique_id="model.b")
+    node_c = tracer.record("dbt.node", start + 50, start + 110, parent=client_span, unique_id="model.c")
+    tracer.record("bigquery.job.queued", start + 50, start + 70, parent=node_c)
+    tracer.record("bigquery.job.running", start + 70, start + 110, parent=node_c)
+    return client_span
+
+
+def test_critical_path_skips_overlapping_siblings(tracer):
+    client_span = record_run(tracer, T0)
+    spans = flushed(tracer)
+    children = children_of(spans)
+
+    root = next(s for s in spans if s["span_id"] == client_span.span_id)
+    path = critical_path(root, children)
+
+    assert [s["attributes"].get("unique_id") or s["name"] for s in path] == [
+        "load_credentials", "model.a", "bigquery.job.queued", "bigquery.job.running",
+    ]
+
+
+def test_critical_path_follows_the_child_that_finished_last(tracer):
+    parent = tracer.record("client", T0, T0 + 100)
+    tracer.record("dbt.node", T0, T0 + 100, parent=parent, unique_id="model.long")
+    tracer.record("dbt.node", T0 + 50, T0 + 99, parent=parent, unique_id="model.late")
+    spans = flushed(tracer)
+    children = children_of(spans)
+
+    path = critical_path(next(s for s in spans if s["name"] == "client"), children)
+    assert [s["attributes"]["unique_id"] for s in path] == ["model.long"]
+
+
+def test_report_shows_the_most_recent_trace(tracer):
+    old = record_run(tracer, T0, client="yesterday")
+    record_run(tracer, T0 + 86400, client="today")
+    spans = flushed(tracer)
+
+    report = render_waterfall(spans)
+    assert "=== today" in report
+    assert "yesterday" not in report
+    assert "scheduling delay 5.0s" in report
+    assert re.search(r"today\s+starts \+\s*10\.0s\s+runs\s+100\.0s", report)
+    assert "Critical path: load_credentials (2.0s) -> dbt.node model.a (38.0s)" in report
+
+    assert "=== yesterday" in render_waterfall(spans, trace_id=old.trace_id)
+
+
+def test_report_without_spans():
+    assert render_waterfall([]) == "No spans found"
@@ -1,4 +1,5 @@
 #!/usr/bin/env python3
+import argparse
 import os
 import sys
 
@@ -11,6 +12,20 @@ os.makedirs(profiles_dir, exist_ok=True)
 current_dir = os.path.dirname(os.path.abspath(__file__))
 creds_path = os.path.join(current_dir, "credentials", "service-account.json")
 
+# Choose threads, timeout and bytes cap for the service_account target the same way
+# the Prefect flow does. The shared dev target keeps the default settings.
+sys.path.insert(0, os.path.join(current_dir, "scripts"))
+from dbt_tuning import DEFAULT_SETTINGS, profile_settings, settings_for_client
+
+parser = argparse.ArgumentParser(description='Write ~/.dbt/profiles.yml with tuned dbt settings')
+parser.add_argument('--client', help='Client whose run history to tune for (defaults to DAG width only)')
+parser.add_argument('--tuning-uri', help='Local path or gs:// URI of the run history (tuning is off without it)')
+args = parser.parse_args()
+
+settings = profile_settings(settings_for_client(args.client, args.tuning_uri, current_dir))
+tuned_lines = "\n".join(f"      {key}: {value}" for key, value in settings.items())
+default_lines = "\n".join(f"      {key}: {value}" for key, value in profile_settings(DEFAULT_SETTINGS).items())
+
 # Create the profiles.yml content
 profiles_content = f"""holistic_money_dw:
   target: dev
@@ -20,8 +35,7 @@ profiles_content = f"""holistic_money_dw:
       method: oauth
       project: "holistic-money"
       dataset: "default_client"
-      threads: 4
-      timeout_seconds: 300
+{default_lines}
       location: US
       priority: interactive
       
@@ -31,8 +45,7 @@ profiles_content = f"""holistic_money_dw:
       project: "holistic-money"
       dataset: "{{{{ env_var('DBT_CLIENT_DATASET', 'default_client') }}}}"
       keyfile: "{creds_path}"
-      threads: 4
-      timeout_seconds: 300
+{tuned_lines}
       location: US
       priority: interactive
 """
@@ -43,4 +56,5 @@ with open(profiles_file, "w") as f:
     f.write(profiles_content)
 
 print(f"Updated dbt profile at {profiles_file}")
-print(f"Service account keyfile path: {creds_path}") 
\ No newline at end of file
+print(f"Service account keyfile path: {creds_path}")
+print(f"dbt settings: {settings}") 
\ No newline at end of file